@@ -1,28 +1,48 @@
 """SQS plugin for Henson."""
 
 import asyncio
-from functools import partial
-import json
-import os
-import pkg_resources
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, partial
+from importlib.metadata import PackageNotFoundError, version
+import warnings
 
 from boto3.session import Session
+from botocore.config import Config
 from henson import Extension
-from lazy import lazy
+
+# _dumps must return str because send_message requires a text body,
+# and _loads must accept the str bodies returned by receive_message.
+# orjson.loads takes str or bytes directly, so no intermediate
+# encode/decode is needed on the consumer side. orjson.dumps returns
+# UTF-8 bytes without escaping non-ASCII characters (unlike stdlib
+# json), so the producer-side decode must remain UTF-8.
+try:
+    import orjson
+
+    def _dumps(obj):
+        """Serialize an object to a JSON-formatted string."""
+        return orjson.dumps(obj).decode()
+
+    _loads = orjson.loads
+except ImportError:
+    import json
+
+    _dumps = json.dumps
+    _loads = json.loads
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
 
 
 __all__ = ('SQS',)
 
 try:
-    _dist = pkg_resources.get_distribution(__package__)
-    if not __file__.startswith(os.path.join(_dist.location, __package__)):
-        # Manually raise the exception if there is a distribution but
-        # it's installed from elsewhere.
-        raise pkg_resources.DistributionNotFound
-except pkg_resources.DistributionNotFound:
+    __version__ = version(__package__)
+except PackageNotFoundError:
     __version__ = 'development'
-else:
-    __version__ = _dist.version
 
 
 class Consumer:
@@ -36,6 +56,9 @@ class Consumer:
             the SQS extension.
         client (boto3.SQS.Client): The SQS client that should be used
             for connections.
+        executor (Optional[concurrent.futures.Executor]): The executor
+            in which to run blocking SQS calls. If not provided, the
+            event loop's default executor is used.
 
     .. versionchanged:: 0.2.0
 
@@ -46,77 +69,279 @@ class Consumer:
         directly.
     """
 
-    def __init__(self, app, client):
+    __slots__ = (
+        'app',
+        'client',
+        '_ack_batch_size',
+        '_ack_entries',
+        '_ack_flush_delay',
+        '_ack_flusher',
+        '_ack_lock',
+        '_consuming',
+        '_decoder',
+        '_executor',
+        '_loop',
+        '_message_queue',
+        '_queue_url',
+        '_receive',
+    )
+
+    def __init__(self, app, client, executor=None):
         """Initialize the consumer."""
         if not app.settings['SQS_INBOUND_QUEUE_URL']:
             raise ValueError(
                 'SQS_INBOUND_QUEUE_URL must be defined to create a consumer.')
+        if app.settings['SQS_WAIT_TIME'] < 1:
+            warnings.warn(
+                'SQS_WAIT_TIME is less than 1, disabling long polling. '
+                'Expect a high volume of empty receive_message calls.',
+                RuntimeWarning,
+            )
         self.app = app
         self.client = client
+        self._executor = executor
         self._consuming = False
+        self._loop = None
+        self._decoder = msgspec.msgpack.Decoder() if msgspec else None
+        # Snapshot the settings used on per-message paths so each
+        # acknowledgement doesn't pay for repeated dict lookups.
+        self._queue_url = app.settings['SQS_INBOUND_QUEUE_URL']
+        # delete_message_batch accepts at most 10 entries.
+        self._ack_batch_size = min(app.settings['SQS_ACK_BATCH_SIZE'], 10)
+        self._ack_flush_delay = app.settings['SQS_ACK_FLUSH_MS'] / 1000
+        self._ack_entries = []
+        self._ack_lock = None
+        self._ack_flusher = None
+        # The receive_message kwargs never change, so freeze them into
+        # a partial once rather than rebuilding them for each call.
+        self._receive = partial(
+            self.client.receive_message,
+            QueueUrl=self._queue_url,
+            AttributeNames=app.settings['SQS_ATTRIBUTE_NAMES'],
+            MessageAttributeNames=app.settings['SQS_MESSAGE_ATTRIBUTES'],
+            # receive_message accepts at most 10 messages per call.
+            MaxNumberOfMessages=min(
+                app.settings['SQS_MESSAGE_BATCH_SIZE'], 10),
+            VisibilityTimeout=app.settings['SQS_VISIBILITY_TIMEOUT'],
+            WaitTimeSeconds=app.settings['SQS_WAIT_TIME'],
+        )
         self.app.message_acknowledgement(self._acknowledge_message)
+        self.app.teardown(self._flush_acknowledgements_on_teardown)
 
-    @asyncio.coroutine
-    def _acknowledge_message(self, app, message):
+    async def _acknowledge_message(self, app, message):
         """Delete a message from the SQS inbound queue.
 
+        Deletions are buffered and sent through
+        ``delete_message_batch``, flushing once ``SQS_ACK_BATCH_SIZE``
+        receipt handles have accumulated or ``SQS_ACK_FLUSH_MS``
+        milliseconds have passed, whichever comes first.
+
         Args:
             app (henson.base.Application): The application that
                 processed the message.
             message (dict): The message returned from the consumer to
                 the application.
         """
-        self.client.delete_message(
-            QueueUrl=self.app.settings['SQS_INBOUND_QUEUE_URL'],
-            ReceiptHandle=message['ReceiptHandle'],
-        )
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        if self._ack_lock is None:
+            # On Python < 3.10, asyncio.Lock binds the default event
+            # loop at construction time. Consumers are typically
+            # created before Henson installs the loop it runs on, so
+            # the lock must be created from a running coroutine.
+            self._ack_lock = asyncio.Lock()
+        async with self._ack_lock:
+            self._ack_entries.append({
+                'Id': str(len(self._ack_entries)),
+                'ReceiptHandle': message['ReceiptHandle'],
+            })
+            if len(self._ack_entries) >= self._ack_batch_size:
+                await self._flush_acknowledgements()
+            elif self._ack_flusher is None:
+                self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Schedule the timed acknowledgement flusher task."""
+        self._ack_flusher = self._loop.create_task(
+            self._flush_acknowledgements_later())
+        self._ack_flusher.add_done_callback(self._flusher_done)
+
+    def _flusher_done(self, task):
+        """Log any exception raised by the timed flusher task.
+
+        Args:
+            task (asyncio.Task): The completed flusher task.
+        """
+        if not task.cancelled() and task.exception() is not None:
+            self.app.logger.error(
+                'acknowledgement.flush_failed', exc_info=task.exception())
 
-    @asyncio.coroutine
-    def _begin_consuming(self):
+    async def _flush_acknowledgements(self):
+        """Delete all buffered receipt handles.
+
+        The acknowledgement lock must be held by the caller. Retried
+        entries can grow the buffer past the batch size, so the buffer
+        is flushed in calls of at most 10 entries, the
+        ``delete_message_batch`` limit.
+        """
+        entries = self._ack_entries
+        if not entries:
+            return
+        self._ack_entries = []
+        for start in range(0, len(entries), 10):
+            chunk = entries[start:start + 10]
+            response = await self._loop.run_in_executor(
+                self._executor, partial(
+                    self.client.delete_message_batch,
+                    QueueUrl=self._queue_url,
+                    Entries=chunk,
+                ))
+            # delete_message_batch reports per-entry failures in the
+            # response instead of raising, so put the receipt handles
+            # that weren't deleted back in the buffer to be retried by
+            # a later flush. Entries rejected with SenderFault (e.g.
+            # an invalid receipt handle) will never succeed; drop them
+            # so they can't occupy batch slots forever.
+            failed = response.get('Failed')
+            if failed:
+                dropped = [
+                    failure for failure in failed
+                    if failure.get('SenderFault')]
+                if dropped:
+                    self.app.logger.warning(
+                        'acknowledgement.dropped', extra={
+                            'dropped': len(dropped),
+                            'codes': sorted({
+                                str(failure.get('Code'))
+                                for failure in dropped}),
+                        })
+                retry_ids = {
+                    failure['Id'] for failure in failed
+                    if not failure.get('SenderFault')}
+                if retry_ids:
+                    self.app.logger.warning(
+                        'acknowledgement.failed', extra={
+                            'failed': len(retry_ids),
+                            'batch_size': len(chunk),
+                        })
+                for entry in chunk:
+                    if entry['Id'] in retry_ids:
+                        self._ack_entries.append({
+                            'Id': str(len(self._ack_entries)),
+                            'ReceiptHandle': entry['ReceiptHandle'],
+                        })
+        # Without a timed flush, retried entries would sit in the
+        # buffer until the next acknowledgement arrives - or forever
+        # on a queue that goes idle.
+        if self._ack_entries and self._ack_flusher is None:
+            self._schedule_flush()
+
+    async def _flush_acknowledgements_later(self):
+        """Flush buffered acknowledgements after a short delay."""
+        await asyncio.sleep(self._ack_flush_delay)
+        async with self._ack_lock:
+            self._ack_flusher = None
+            await self._flush_acknowledgements()
+
+    async def _flush_acknowledgements_on_teardown(self, app):
+        """Flush any remaining acknowledgements at shutdown.
+
+        Without this, up to ``SQS_ACK_BATCH_SIZE - 1`` processed
+        messages could be left undeleted on a graceful stop and be
+        redelivered after the visibility timeout.
+
+        Args:
+            app (henson.base.Application): The application that is
+                shutting down.
+        """
+        if self._ack_lock is None:
+            return
+        if self._ack_flusher is not None:
+            self._ack_flusher.cancel()
+            self._ack_flusher = None
+        async with self._ack_lock:
+            await self._flush_acknowledgements()
+            # The flush reschedules the timer if it re-queued failed
+            # entries, but the loop is about to close, so cancel it.
+            if self._ack_flusher is not None:
+                self._ack_flusher.cancel()
+                self._ack_flusher = None
+
+    async def _begin_consuming(self):
         """Begin consuming from the SQS queue."""
         self._consuming = True
-        loop = asyncio.get_event_loop()
+        self._loop = asyncio.get_running_loop()
         self._message_queue = asyncio.Queue(
-            maxsize=self.app.settings['SQS_PREFETCH_LIMIT'],
-            loop=loop,
-        )
-        loop.create_task(self._consume())
+            maxsize=self.app.settings['SQS_PREFETCH_LIMIT'])
+        self._loop.create_task(self._consume())
+
+    def _decode_body(self, message):
+        """Decode a message's body in place.
 
-    @asyncio.coroutine
-    def _consume(self):
+        The codec is selected by the message's ``Codec`` message
+        attribute, falling back to JSON when the attribute is absent.
+
+        Args:
+            message (dict): The message returned by SQS.
+
+        Raises:
+            ValueError: If the message is encoded with msgpack but
+                msgspec is not installed.
+        """
+        attributes = message.get('MessageAttributes') or {}
+        codec = attributes.get('Codec', {}).get('StringValue')
+        if codec == 'msgpack':
+            if self._decoder is None:
+                raise ValueError(
+                    'msgspec must be installed to decode msgpack messages.')
+            message['Body'] = self._decoder.decode(
+                base64.b64decode(message['Body']))
+        else:
+            message['Body'] = _loads(message['Body'])
+
+    async def _consume(self):
         """Fetch messages from the configured SQS queue."""
         # HACK: run_in_executor is used as a workaround to use boto
         # inside a coroutine. This is a stopgap solution that should be
         # replaced once boto has support for asyncio or aiobotocore has
         # a stable release.
-        loop = asyncio.get_event_loop()
-        receive_message = partial(
-            self.client.receive_message,
-            QueueUrl=self.app.settings['SQS_INBOUND_QUEUE_URL'],
-            AttributeNames=self.app.settings['SQS_ATTRIBUTE_NAMES'],
-            MessageAttributeNames=self.app.settings['SQS_MESSAGE_ATTRIBUTES'],
-            MaxNumberOfMessages=self.app.settings['SQS_MESSAGE_BATCH_SIZE'],
-            VisibilityTimeout=self.app.settings['SQS_VISIBILITY_TIMEOUT'],
-            WaitTimeSeconds=self.app.settings['SQS_WAIT_TIME'],
-        )
         while True:
-            future = loop.run_in_executor(None, receive_message)
-            messages = yield from future
-            for message in messages.get('Messages', []):
-                message['Body'] = json.loads(message['Body'])
-                yield from self._message_queue.put(message)
-
-    @asyncio.coroutine
-    def read(self):
+            future = self._loop.run_in_executor(self._executor, self._receive)
+            messages = await future
+            for message in messages.get('Messages') or ():
+                # A decode failure must not kill this task: it would
+                # die unobserved and leave every subsequent read()
+                # blocked forever. Pass the exception through the
+                # queue so it's raised where it can be handled.
+                try:
+                    self._decode_body(message)
+                except Exception as e:
+                    await self._message_queue.put(e)
+                else:
+                    await self._message_queue.put(message)
+
+    async def read(self):
         """Read a single message from the message queue.
 
+        Messages are fetched from SQS in batches of up to
+        ``SQS_MESSAGE_BATCH_SIZE`` and buffered internally, so most
+        calls are served without an API round trip.
+
         Returns:
-            dict: A JSON-decoded message.
+            dict: A decoded message.
+
+        Raises:
+            Exception: If the message's body could not be decoded. The
+                message is left on the queue for redelivery after the
+                visibility timeout.
 
         """
         if not self._consuming:
-            yield from self._begin_consuming()
-        return (yield from self._message_queue.get())
+            await self._begin_consuming()
+        message = await self._message_queue.get()
+        if isinstance(message, Exception):
+            raise message
+        return message
 
 
 class Producer:
@@ -127,6 +352,9 @@ class Producer:
             the SQS extension.
         client (boto3.SQS.Client): The client with which to write
             messages.
+        executor (Optional[concurrent.futures.Executor]): The executor
+            in which to run blocking SQS calls. If not provided, the
+            event loop's default executor is used.
 
     .. versionchanged:: 0.2.0
 
@@ -137,16 +365,60 @@ class Producer:
         directly.
     """
 
-    def __init__(self, app, client):
+    __slots__ = (
+        'app',
+        'client',
+        '_encoder',
+        '_executor',
+        '_loop',
+        '_queue_url',
+    )
+
+    def __init__(self, app, client, executor=None):
         """Initialize the producer."""
         if not app.settings['SQS_OUTBOUND_QUEUE_URL']:
             raise ValueError(
                 'SQS_OUTBOUND_QUEUE_URL must be defined to create a producer.')
         self.app = app
         self.client = client
+        self._executor = executor
+        self._loop = None
+        self._queue_url = app.settings['SQS_OUTBOUND_QUEUE_URL']
+        if app.settings['SQS_BODY_CODEC'] == 'msgpack':
+            if msgspec is None:
+                raise ValueError(
+                    'msgspec must be installed to use the msgpack codec.')
+            self._encoder = msgspec.msgpack.Encoder()
+        else:
+            self._encoder = None
+
+    def _encode(self, message, message_attributes):
+        """Encode a message body with the configured codec.
 
-    @asyncio.coroutine
-    def send(self, message, delay=0, message_attributes=None):
+        Args:
+            message (dict): The message to encode.
+            message_attributes (dict): Attributes to be sent along with
+                the message body.
+
+        Returns:
+            Tuple[str, dict]: The encoded body and the message
+                attributes, updated to record the codec when one other
+                than JSON is used.
+        """
+        if self._encoder is not None:
+            # SQS message bodies must be text, so the msgpack bytes are
+            # base64-encoded. The codec is recorded in a message
+            # attribute so consumers know how to decode the body.
+            body = base64.b64encode(self._encoder.encode(message)).decode()
+            message_attributes = dict(
+                message_attributes,
+                Codec={'DataType': 'String', 'StringValue': 'msgpack'},
+            )
+        else:
+            body = _dumps(message)
+        return body, message_attributes
+
+    async def send(self, message, delay=0, message_attributes=None):
         """Send the message to the queue.
 
         Args:
@@ -158,12 +430,63 @@ class Producer:
         """
         if message_attributes is None:
             message_attributes = {}
-        return self.client.send_message(
-            QueueUrl=self.app.settings['SQS_OUTBOUND_QUEUE_URL'],
-            MessageBody=json.dumps(message),
-            DelaySeconds=delay,
-            MessageAttributes=message_attributes,
-        )
+        body, message_attributes = self._encode(message, message_attributes)
+        kwargs = {
+            'QueueUrl': self._queue_url,
+            'MessageBody': body,
+            'DelaySeconds': delay,
+        }
+        # An empty MessageAttributes mapping would still be serialized
+        # and signed by botocore, so only pass it when it has entries.
+        if message_attributes:
+            kwargs['MessageAttributes'] = message_attributes
+        # HACK: As in Consumer._consume, run_in_executor keeps the
+        # blocking boto call from stalling the event loop for the
+        # duration of the round trip.
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        return await self._loop.run_in_executor(
+            self._executor, partial(self.client.send_message, **kwargs))
+
+    async def send_many(self, messages, delay=0):
+        """Send up to 10 messages to the queue in one batch call.
+
+        Packing messages into a single ``send_message_batch`` call
+        amortizes the HTTPS round trip and request signing across the
+        whole batch.
+
+        Args:
+            messages (Sequence[dict]): The messages to send.
+            delay (int): The number of seconds until the messages
+              become consumable from the queue.
+
+        Returns:
+            dict: The response from ``send_message_batch``.
+
+        Raises:
+            ValueError: If more than 10 messages are provided.
+        """
+        if len(messages) > 10:
+            raise ValueError(
+                'send_message_batch accepts at most 10 messages.')
+        entries = []
+        for index, message in enumerate(messages):
+            body, message_attributes = self._encode(message, {})
+            entry = {
+                'Id': str(index),
+                'MessageBody': body,
+                'DelaySeconds': delay,
+            }
+            if message_attributes:
+                entry['MessageAttributes'] = message_attributes
+            entries.append(entry)
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        return await self._loop.run_in_executor(self._executor, partial(
+            self.client.send_message_batch,
+            QueueUrl=self._queue_url,
+            Entries=entries,
+        ))
 
 
 class SQS(Extension):
@@ -176,12 +499,19 @@ class SQS(Extension):
     """
 
     DEFAULT_SETTINGS = {
+        'SQS_ACK_BATCH_SIZE': 10,
+        'SQS_ACK_FLUSH_MS': 200,
         'SQS_ATTRIBUTE_NAMES': ['All'],
+        'SQS_BODY_CODEC': 'json',
         'SQS_INBOUND_QUEUE_URL': None,
+        'SQS_IO_THREADS': 4,
         'SQS_MESSAGE_ATTRIBUTES': ['All'],
         'SQS_MESSAGE_BATCH_SIZE': 10,
         'SQS_OUTBOUND_QUEUE_URL': None,
-        'SQS_PREFETCH_LIMIT': 0,
+        'SQS_POOL_CONNECTIONS': 32,
+        # Two receive batches' worth of messages; 0 would make the
+        # internal queue unbounded.
+        'SQS_PREFETCH_LIMIT': 20,
         'SQS_VISIBILITY_TIMEOUT': 60,
         'SQS_WAIT_TIME': 20,
         'AWS_ACCESS_KEY': None,
@@ -189,7 +519,28 @@ class SQS(Extension):
         'AWS_REGION_NAME': None,
     }
 
-    @lazy
+    def init_app(self, app):
+        """Initialize the application for use with SQS.
+
+        The SQS client is resolved here so that boto3's session,
+        endpoint resolution, and connection pool setup happen at
+        startup instead of inside the first message's coroutine. When
+        an inbound queue is configured, a ``get_queue_attributes`` call
+        is also made to establish a keepalive connection and surface
+        credential problems immediately.
+
+        Args:
+            app (henson.base.Application): An application instance that
+                will be initialized.
+        """
+        super().init_app(app)
+        client = self.client
+        queue_url = app.settings['SQS_INBOUND_QUEUE_URL']
+        if queue_url:
+            client.get_queue_attributes(
+                QueueUrl=queue_url, AttributeNames=['QueueArn'])
+
+    @cached_property
     def client(self):
         """Return the connection to SQS.
 
@@ -202,7 +553,26 @@ class SQS(Extension):
             aws_secret_access_key=self.app.settings['AWS_ACCESS_SECRET'],
             region_name=self.app.settings['AWS_REGION_NAME'],
         )
-        return session.client('sqs')
+        config = Config(
+            max_pool_connections=self.app.settings['SQS_POOL_CONNECTIONS'],
+            tcp_keepalive=True,
+            retries={'mode': 'standard', 'max_attempts': 5},
+        )
+        return session.client('sqs', config=config)
+
+    @cached_property
+    def executor(self):
+        """Return the thread pool used for blocking SQS calls.
+
+        A dedicated pool keeps long-polling receives from starving
+        other users of the event loop's default executor.
+
+        Returns:
+            concurrent.futures.ThreadPoolExecutor: The thread pool.
+
+        """
+        return ThreadPoolExecutor(
+            max_workers=self.app.settings['SQS_IO_THREADS'])
 
     def consumer(self):
         """Return a new SQS consumer.
@@ -211,7 +581,8 @@ class SQS(Extension):
             Consumer: The new consumer.
 
         """
-        return Consumer(app=self.app, client=self.client)
+        return Consumer(
+            app=self.app, client=self.client, executor=self.executor)
 
     def producer(self):
         """Return a new SQS producer.
@@ -220,4 +591,5 @@ class SQS(Extension):
             Producer: The new producer.
 
         """
-        return Producer(app=self.app, client=self.client)
+        return Producer(
+            app=self.app, client=self.client, executor=self.executor)
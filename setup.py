@@ -2,16 +2,22 @@ from setuptools import find_packages, setup
 
 setup(
     name='Henson-SQS',
-    version='0.2.1',
+    version='0.3.0',
     packages=find_packages(exclude=['tests']),
     install_requires=[
-        'boto3>=1.1.1',
+        'boto3>=1.26',
         'Henson>=1.2.0',
-        'lazy>=1.2',
+        'orjson',
     ],
+    extras_require={
+        'msgpack': [
+            'msgspec',
+        ],
+    },
     tests_require=[
         'tox',
     ],
+    python_requires='>=3.8',
     classifiers=[
         'Development Status :: 4 - Beta',
         'Intended Audience :: Developers',
@@ -19,9 +25,8 @@ setup(
         'Natural Language :: English',
         'Operating System :: POSIX',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
         'Programming Language :: Python :: 3 :: Only',
         'Topic :: Software Development :: Libraries :: Application Frameworks',
     ]